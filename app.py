@@ -5,10 +5,13 @@ import streamlit as st
 from typing import Generator, Dict, Set
 from pathlib import Path
 import base64
+import uuid
 from dataclasses import dataclass
 
-from config import APP_TITLE, APP_ICON, APP_LAYOUT
+from config import APP_TITLE, APP_ICON, APP_LAYOUT, RATE_LIMITING
 from services import ChatService, APIError
+from scheduler import RateLimit, request_scheduler
+from profiler import profiler
 from logger import app_logger
 
 @dataclass
@@ -16,6 +19,10 @@ class Department:
     name: str
     drive_folders: list[str]
     allowed_roles: set[str]
+    # Shared by all requests charged to the department
+    rate_limit: RateLimit = RateLimit(requests_per_minute=60, burst=10)
+    # Applied to each role whose primary department this is
+    role_rate_limit: RateLimit = RateLimit(requests_per_minute=20, burst=5)
 
 # Department configurations
 DEPARTMENTS: Dict[str, Department] = {
@@ -32,7 +39,9 @@ DEPARTMENTS: Dict[str, Department] = {
     "sales": Department(
         name="sales",
         drive_folders=["Sales", "Customer Data", "Contracts"],
-        allowed_roles={"admin", "sales_manager", "sales_rep"}
+        allowed_roles={"admin", "sales_manager", "sales_rep"},
+        rate_limit=RateLimit(requests_per_minute=30, burst=6),
+        role_rate_limit=RateLimit(requests_per_minute=10, burst=3)
     ),
     "finance": Department(
         name="finance",
@@ -51,7 +60,8 @@ DEPARTMENTS: Dict[str, Department] = {
             "admin", "hr_manager", "tech_lead", "sales_manager",
             "finance_manager", "ops_manager", "hr_staff", "engineer",
             "sales_rep", "accountant", "ops_staff", "process_analyst"
-        }
+        },
+        rate_limit=RateLimit(requests_per_minute=120, burst=20)
     )
 }
 
@@ -81,6 +91,44 @@ def get_department_for_role(role: str) -> str:
             return dept_name
     return "general"
 
+def get_rate_limit_department(role: str) -> str:
+    """
+    Get the department a role's requests are charged to.
+
+    Roles that belong to more than one department (such as admin) are charged
+    to the shared general bucket rather than to whichever department is listed first.
+    """
+    departments = [
+        name for name, dept in DEPARTMENTS.items()
+        if role in dept.allowed_roles and name != "general"
+    ]
+    return departments[0] if len(departments) == 1 else "general"
+
+# Per-role token buckets overriding the charged department's role_rate_limit
+ROLE_RATE_LIMITS: Dict[str, RateLimit] = {
+    "admin": RateLimit(requests_per_minute=60, burst=10)
+}
+
+# Fair queueing weights (roles not listed get 1.0)
+ROLE_WEIGHTS: Dict[str, float] = {
+    "admin": 4.0,
+    "hr_manager": 2.0,
+    "tech_lead": 2.0,
+    "sales_manager": 2.0,
+    "finance_manager": 2.0,
+    "ops_manager": 2.0
+}
+
+# Apply rate limits (idempotent across reruns, bucket state is kept)
+request_scheduler.configure(
+    role_limits={
+        role: ROLE_RATE_LIMITS.get(role, DEPARTMENTS[get_rate_limit_department(role)].role_rate_limit)
+        for role in ALL_ROLES
+    },
+    department_limits={name: dept.rate_limit for name, dept in DEPARTMENTS.items()},
+    role_weights=ROLE_WEIGHTS
+)
+
 def stream_response(prompt: str, user_role: str) -> Generator[str, None, None]:
     """
     Create a generator for streaming the response.
@@ -93,7 +141,8 @@ def stream_response(prompt: str, user_role: str) -> Generator[str, None, None]:
         Accumulated response text
     """
     response_text = ""
-    for chunk in ChatService.send_message(prompt, user_role=user_role):
+    department = get_rate_limit_department(user_role)
+    for chunk in ChatService.send_message(prompt, user_role=user_role, department=department):
         response_text += chunk
         yield response_text
     return response_text
@@ -105,28 +154,35 @@ st.set_page_config(
     layout=APP_LAYOUT
 )
 
-# Initialize session state for messages and response
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-    app_logger.info("Initialized new chat session")
-
-# Initialize session state for role
-if "current_role" not in st.session_state:
-    st.session_state.current_role = "admin"  # Default role
-
-def on_role_change():
-    """Handle role change events."""
-    app_logger.info(f"Role changed to: {st.session_state.role_selector}")
-    st.session_state.current_role = st.session_state.role_selector
-    # Clear messages when role changes to maintain context separation
-    st.session_state.messages = []
-
-# Define paths
-LOGO_PATH = "static/images/logo.png"
-PROFILE_PIC_PATH = "static/images/profile.jpg"
-
-# Custom CSS for logo, welcome message and sidebar
-st.markdown("""
+# Identify the session for profiling and start timing this rerun
+if "session_id" not in st.session_state:
+    st.session_state.session_id = uuid.uuid4().hex
+profiler.begin_run(st.session_state.session_id)
+
+try:
+    # Initialize session state for messages and response
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+        app_logger.info("Initialized new chat session")
+
+    # Initialize session state for role
+    if "current_role" not in st.session_state:
+        st.session_state.current_role = "admin"  # Default role
+
+    def on_role_change():
+        """Handle role change events."""
+        app_logger.info(f"Role changed to: {st.session_state.role_selector}")
+        st.session_state.current_role = st.session_state.role_selector
+        # Clear messages when role changes to maintain context separation
+        st.session_state.messages = []
+
+    # Define paths
+    LOGO_PATH = "static/images/logo.png"
+    PROFILE_PIC_PATH = "static/images/profile.jpg"
+
+    # Custom CSS for logo, welcome message and sidebar
+    with profiler.span("css"):
+        st.markdown("""
 <style>
 /* Full-page animated gradient background */
 @keyframes gradientBG {
@@ -342,117 +398,144 @@ div[data-testid="stSelectbox"] > div > div {
 </style>
 """, unsafe_allow_html=True)
 
-# Sidebar content
-with st.sidebar:
-    # Profile section
-    if Path(PROFILE_PIC_PATH).exists():
+    # Sidebar content
+    with st.sidebar, profiler.span("sidebar"):
+        # Profile section
+        if Path(PROFILE_PIC_PATH).exists():
+            with profiler.span("profile_image"):
+                profile_pic = base64.b64encode(open(PROFILE_PIC_PATH, "rb").read()).decode()
+            st.markdown(
+                f"""
+                <div class="profile-section">
+                    <img src="data:image/jpeg;base64,{profile_pic}" class="profile-image" />
+                    <h4 class="profile-name">Joshua Lieb</h4>
+                    <p class="profile-role">{ROLE_DISPLAY_NAMES.get(st.session_state.current_role, st.session_state.current_role)}</p>
+                    <div class="department-tag">{get_department_for_role(st.session_state.current_role).title()} Department</div>
+                </div>
+                <hr class="sidebar-divider" />
+                """,
+                unsafe_allow_html=True,
+            )
+        else:
+            st.warning("Profile picture not found. Using default settings.")
+
+        # Role selector
         st.markdown(
-            f"""
-            <div class="profile-section">
-                <img src="data:image/jpeg;base64,{base64.b64encode(open(PROFILE_PIC_PATH, "rb").read()).decode()}" class="profile-image" />
-                <h4 class="profile-name">Joshua Lieb</h4>
-                <p class="profile-role">{ROLE_DISPLAY_NAMES.get(st.session_state.current_role, st.session_state.current_role)}</p>
-                <div class="department-tag">{get_department_for_role(st.session_state.current_role).title()} Department</div>
+            """
+            <div style='text-align: center;'>
+                <h4 class="role-heading">Select Role</h4>
             </div>
-            <hr class="sidebar-divider" />
             """,
             unsafe_allow_html=True,
         )
-    else:
-        st.warning("Profile picture not found. Using default settings.")
-
-    # Role selector
-    st.markdown(
-        """
-        <div style='text-align: center;'>
-            <h4 class="role-heading">Select Role</h4>
-        </div>
-        """,
-        unsafe_allow_html=True,
-    )
-
-    # Update the current role when selection changes
-    st.selectbox(
-        "Please select your Role",
-        sorted(ALL_ROLES),
-        format_func=lambda x: ROLE_DISPLAY_NAMES.get(x, x),
-        key="role_selector",
-        label_visibility="collapsed",
-        on_change=on_role_change,
-        index=sorted(ALL_ROLES).index(st.session_state.current_role)
-    )
 
-# Main content
-# Display logo and welcome message
-if Path(LOGO_PATH).exists():
-    st.markdown(f'<div class="logo-container"><img src="data:image/png;base64,{base64.b64encode(open(LOGO_PATH, "rb").read()).decode()}" /></div>', unsafe_allow_html=True)
-    st.markdown("""
-        <div class="welcome-container">
-            <h1>Welcome to IRIS</h1>
-            <p>Your Intelligent Response & Information System<br><i>"Empowering clarity through conversation."</i></p>
-        </div>
-    """, unsafe_allow_html=True)
-else:
-    st.error("Logo file not found!")
-
-st.markdown("---")
-
-# Check API health
-if not ChatService.health_check():
-    error_msg = "Unable to connect to the chat service. Please try again later."
-    app_logger.error(error_msg)
-    st.error(f"⚠️ {error_msg}")
-    st.stop()
-
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
-
-# Chat input
-if prompt := st.chat_input("Ask me anything..."):
-    app_logger.info(f"Received user input: {prompt}")
-    app_logger.info(f"Current role: {st.session_state.current_role}")  # Add logging for debugging
-
-    # Add user message
-    st.session_state.messages.append({"role": "user", "content": prompt})
-    with st.chat_message("user"):
-        st.markdown(prompt)
-
-    # Get AI response
-    with st.chat_message("assistant"):
-        try:
-            response_container = st.empty()
-
-            # Split the text into individual characters for the shine animation
-            thinking_text = "🤔 IRIS is thinking"
-            animated_text = '<div class="thinking-text">' + ''.join([f'<span>{char}</span>' for char in thinking_text]) + '</div>'
-
-            # Show initial thinking message with character shine animation
-            response_container.markdown(
-                f'{animated_text}<span class="thinking-dots"><span>.</span><span>.</span><span>.</span></span>',
-                unsafe_allow_html=True
-            )
+        # Update the current role when selection changes
+        st.selectbox(
+            "Please select your Role",
+            sorted(ALL_ROLES),
+            format_func=lambda x: ROLE_DISPLAY_NAMES.get(x, x),
+            key="role_selector",
+            label_visibility="collapsed",
+            on_change=on_role_change,
+            index=sorted(ALL_ROLES).index(st.session_state.current_role)
+        )
 
-            # Stream the response with user role
-            final_response = ""
-            current_role = st.session_state.current_role
-
-            for response_text in stream_response(prompt, user_role=current_role):
-                response_container.markdown(response_text)
-                final_response = response_text
-
-            # Store the complete response
-            st.session_state.messages.append({
-                "role": "assistant",
-                "content": final_response
-            })
-            app_logger.info("Successfully processed user request")
-
-        except APIError as e:
-            error_msg = f"Error: {str(e)}"
-            app_logger.error(error_msg)
-            st.error(error_msg)
-            # Remove the user message if we couldn't get a response
-            st.session_state.messages.pop()
-            app_logger.info("Removed failed message from chat history")
+        # Queue wait times per role, for tuning ROLE_WEIGHTS (admin only)
+        if RATE_LIMITING and st.session_state.current_role == "admin":
+            with st.expander("Queue wait times"):
+                wait_stats = request_scheduler.wait_stats()
+                if wait_stats:
+                    st.table([
+                        {
+                            "Role": ROLE_DISPLAY_NAMES.get(role, role),
+                            "Requests": int(stats["requests"]),
+                            "Avg wait (s)": f"{stats['avg_wait']:.3f}",
+                            "Max wait (s)": f"{stats['max_wait']:.3f}"
+                        }
+                        for role, stats in sorted(wait_stats.items())
+                    ])
+                else:
+                    st.caption("No requests have been queued yet.")
+
+    # Main content
+    # Display logo and welcome message
+    if Path(LOGO_PATH).exists():
+        with profiler.span("logo_image"):
+            logo = base64.b64encode(open(LOGO_PATH, "rb").read()).decode()
+        st.markdown(f'<div class="logo-container"><img src="data:image/png;base64,{logo}" /></div>', unsafe_allow_html=True)
+        st.markdown("""
+            <div class="welcome-container">
+                <h1>Welcome to IRIS</h1>
+                <p>Your Intelligent Response & Information System<br><i>"Empowering clarity through conversation."</i></p>
+            </div>
+        """, unsafe_allow_html=True)
+    else:
+        st.error("Logo file not found!")
+
+    st.markdown("---")
+
+    # Check API health
+    with profiler.span("health_check"):
+        is_healthy = ChatService.health_check()
+    if not is_healthy:
+        error_msg = "Unable to connect to the chat service. Please try again later."
+        app_logger.error(error_msg)
+        st.error(f"⚠️ {error_msg}")
+        st.stop()
+
+    # Display chat messages
+    with profiler.span("history"):
+        for message in st.session_state.messages:
+            with st.chat_message(message["role"]):
+                st.markdown(message["content"])
+
+    # Chat input
+    if prompt := st.chat_input("Ask me anything..."):
+        app_logger.info(f"Received user input: {prompt}")
+        app_logger.info(f"Current role: {st.session_state.current_role}")  # Add logging for debugging
+
+        # Add user message
+        st.session_state.messages.append({"role": "user", "content": prompt})
+        with st.chat_message("user"):
+            st.markdown(prompt)
+
+        # Get AI response
+        with st.chat_message("assistant"):
+            try:
+                response_container = st.empty()
+
+                # Split the text into individual characters for the shine animation
+                thinking_text = "🤔 IRIS is thinking"
+                animated_text = '<div class="thinking-text">' + ''.join([f'<span>{char}</span>' for char in thinking_text]) + '</div>'
+
+                # Show initial thinking message with character shine animation
+                response_container.markdown(
+                    f'{animated_text}<span class="thinking-dots"><span>.</span><span>.</span><span>.</span></span>',
+                    unsafe_allow_html=True
+                )
+
+                # Stream the response with user role
+                final_response = ""
+                current_role = st.session_state.current_role
+
+                with profiler.span("streaming"):
+                    for response_text in stream_response(prompt, user_role=current_role):
+                        response_container.markdown(response_text)
+                        final_response = response_text
+
+                # Store the complete response
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": final_response
+                })
+                app_logger.info("Successfully processed user request")
+
+            except APIError as e:
+                error_msg = f"Error: {str(e)}"
+                app_logger.error(error_msg)
+                st.error(error_msg)
+                # Remove the user message if we couldn't get a response
+                st.session_state.messages.pop()
+                app_logger.info("Removed failed message from chat history")
+finally:
+    profiler.end_run()
@@ -24,10 +24,32 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG").upper()
 CONSOLE_LOGGING = os.getenv("CONSOLE_LOGGING", "true").lower() == "true"
 FILE_LOGGING = os.getenv("FILE_LOGGING", "true").lower() == "true"
 
+# Rate Limiting Settings
+RATE_LIMITING = os.getenv("RATE_LIMITING", "true").lower() == "true"
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", "4"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "30"))
+WAIT_STATS_INTERVAL = float(os.getenv("WAIT_STATS_INTERVAL", "300"))
+
+# Profiling Settings
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0.0"))
+
 # Validate layout
 if APP_LAYOUT not in ["wide", "centered"]:
     raise ValueError("APP_LAYOUT must be either 'wide' or 'centered'")
 
+# Validate rate limiting
+if MAX_CONCURRENT_REQUESTS < 1:
+    raise ValueError("MAX_CONCURRENT_REQUESTS must be at least 1")
+if QUEUE_TIMEOUT <= 0:
+    raise ValueError("QUEUE_TIMEOUT must be greater than 0")
+if WAIT_STATS_INTERVAL < 0:
+    raise ValueError("WAIT_STATS_INTERVAL must be 0 (disabled) or greater")
+
+# Validate profiling
+if not 0.0 <= PROFILING_SAMPLE_RATE <= 1.0:
+    raise ValueError("PROFILING_SAMPLE_RATE must be between 0.0 and 1.0")
+
 # API Endpoints
 @lru_cache
 def get_chat_endpoint() -> str:
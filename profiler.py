@@ -0,0 +1,256 @@
+"""
+Opt-in per-rerun profiling of the Streamlit script.
+"""
+import os
+import json
+import random
+import cProfile
+import threading
+from time import perf_counter
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+from datetime import datetime
+from typing import Dict, Optional
+
+from config import PROFILING, PROFILING_SAMPLE_RATE
+from logger import LOGS_DIR, app_logger
+
+PROFILE_DIR = os.path.join(LOGS_DIR, "profile")
+
+# Sessions whose summaries are kept; the least recently seen is dropped
+MAX_SESSIONS = 100
+# cProfile dumps kept on disk; the oldest is deleted
+MAX_PROFILE_DUMPS = 20
+
+# Returned by span() when no run is being profiled
+_NULL_SPAN = nullcontext()
+
+class _Run:
+    """Timing state of a single script rerun."""
+
+    def __init__(self, session_id: str, profile: Optional[cProfile.Profile]):
+        self.session_id = session_id
+        self.profile = profile
+        # Open spans as [name, start, time spent in child spans]
+        self.stack = [["rerun", perf_counter(), 0.0]]
+        # Span path -> [total seconds, self seconds]
+        self.spans: Dict[str, list[float]] = {}
+
+    def close_span(self) -> None:
+        name, start, child_time = self.stack.pop()
+        elapsed = perf_counter() - start
+        path = ";".join([frame[0] for frame in self.stack] + [name])
+        totals = self.spans.setdefault(path, [0.0, 0.0])
+        totals[0] += elapsed
+        totals[1] += elapsed - child_time
+        if self.stack:
+            self.stack[-1][2] += elapsed
+
+class _Span:
+    """Context manager timing a named phase nested under the open spans."""
+
+    __slots__ = ("run", "name")
+
+    def __init__(self, run: _Run, name: str):
+        self.run = run
+        self.name = name
+
+    def __enter__(self):
+        self.run.stack.append([self.name, perf_counter(), 0.0])
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.run.close_span()
+        return False
+
+class Profiler:
+    """
+    Times named phases of each rerun and writes the results to the logs directory.
+
+    Each Streamlit session runs its script on its own thread, so the current
+    run is kept thread-local. For every finished run the profiler rewrites:
+
+    - ``session-<id>.json``: per-span call count, total, mean and max seconds
+      for that session
+    - ``spans.folded``: self time in microseconds per span stack, aggregated over
+      all sessions, in the folded format read by flamegraph.pl and speedscope
+
+    A fraction of runs (``sample_rate``) is additionally profiled with cProfile
+    and dumped as ``.prof`` files. Only one run is sampled at a time, and only
+    the newest ``MAX_PROFILE_DUMPS`` dumps are kept.
+
+    Files are written from a snapshot taken under the lock, not while holding
+    it. At most ``MAX_SESSIONS`` sessions are tracked: the least recently seen
+    one is dropped from memory and its JSON file deleted, so a session seen
+    again after that starts a new summary.
+    """
+
+    def __init__(self, enabled: bool, sample_rate: float, output_dir: str):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sampling = False
+        self._sessions: "OrderedDict[str, Dict[str, Dict[str, float]]]" = OrderedDict()
+        self._folded: Dict[str, float] = {}
+        # Version of the aggregated folded stacks, so stale snapshots are not written
+        self._folded_version = 0
+        self._written_version = 0
+        self._write_lock = threading.Lock()
+        self._dumps: deque[str] = deque()
+
+        if enabled:
+            os.makedirs(output_dir, exist_ok=True)
+            # Count dumps left by earlier server runs towards the cap
+            dumps = [
+                os.path.join(output_dir, name)
+                for name in os.listdir(output_dir) if name.endswith(".prof")
+            ]
+            self._dumps.extend(sorted(dumps, key=os.path.getmtime))
+            app_logger.info(f"Profiling enabled, writing results to {output_dir}")
+
+    def begin_run(self, session_id: str) -> None:
+        """
+        Start timing a rerun on the current thread.
+
+        Args:
+            session_id: Identifier of the Streamlit session
+        """
+        if not self.enabled:
+            return
+
+        profile = None
+        if random.random() < self.sample_rate:
+            with self._lock:
+                if not self._sampling:
+                    self._sampling = True
+                    profile = cProfile.Profile()
+            if profile is not None:
+                try:
+                    profile.enable()
+                except ValueError:
+                    # Another profiler is active
+                    profile = None
+                    with self._lock:
+                        self._sampling = False
+
+        self._local.run = _Run(session_id, profile)
+
+    def span(self, name: str):
+        """
+        Time a named phase of the current rerun.
+
+        Args:
+            name: Name of the phase
+
+        Returns:
+            Context manager timing the enclosed block (a no-op when profiling is off)
+        """
+        run = getattr(self._local, "run", None) if self.enabled else None
+        if run is None:
+            return _NULL_SPAN
+        return _Span(run, name)
+
+    def end_run(self) -> None:
+        """Finish the current rerun and write its results. Call from a finally block."""
+        if not self.enabled:
+            return
+        run = getattr(self._local, "run", None)
+        if run is None:
+            return
+        self._local.run = None
+
+        while run.stack:
+            run.close_span()
+
+        if run.profile is not None:
+            self._dump_profile(run)
+
+        with self._lock:
+            session = self._sessions.pop(run.session_id, {})
+            self._sessions[run.session_id] = session
+            evicted = []
+            while len(self._sessions) > MAX_SESSIONS:
+                evicted.append(self._sessions.popitem(last=False)[0])
+
+            for path, (total, self_time) in run.spans.items():
+                stats = session.setdefault(path, {"calls": 0, "total": 0.0, "max": 0.0})
+                stats["calls"] += 1
+                stats["total"] += total
+                stats["max"] = max(stats["max"], total)
+                self._folded[path] = self._folded.get(path, 0.0) + self_time
+
+            summary = {
+                path: {**stats, "mean": stats["total"] / stats["calls"]}
+                for path, stats in session.items()
+            }
+            folded = dict(self._folded)
+            self._folded_version += 1
+            version = self._folded_version
+
+        try:
+            for session_id in evicted:
+                self._remove(f"session-{session_id}.json")
+
+            self._write(f"session-{run.session_id}.json", json.dumps(summary, indent=2))
+            # Evicted by another run while writing
+            with self._lock:
+                evicted_meanwhile = run.session_id not in self._sessions
+            if evicted_meanwhile:
+                self._remove(f"session-{run.session_id}.json")
+
+            # Only the folded file is shared between sessions; skip stale snapshots
+            with self._write_lock:
+                if version > self._written_version:
+                    lines = [f"{path} {round(seconds * 1e6)}" for path, seconds in sorted(folded.items())]
+                    self._write("spans.folded", "\n".join(lines) + "\n")
+                    self._written_version = version
+        except OSError as e:
+            app_logger.warning(f"Failed to write profile: {str(e)}")
+
+        app_logger.debug(f"Rerun took {run.spans['rerun'][0] * 1000:.1f} ms")
+
+    def _dump_profile(self, run: _Run) -> None:
+        """Stop the run's cProfile, dump it and release the sampling slot."""
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        path = os.path.join(self.output_dir, f"session-{run.session_id}-{timestamp}.prof")
+        try:
+            run.profile.disable()
+            run.profile.dump_stats(path)
+        except OSError as e:
+            app_logger.warning(f"Failed to write profile: {str(e)}")
+            return
+        finally:
+            with self._lock:
+                self._sampling = False
+
+        with self._lock:
+            self._dumps.append(path)
+            expired = []
+            while len(self._dumps) > MAX_PROFILE_DUMPS:
+                expired.append(self._dumps.popleft())
+        for old_path in expired:
+            try:
+                os.remove(old_path)
+            except OSError:
+                pass
+
+    def _remove(self, filename: str) -> None:
+        """Delete a file from the output directory if it exists."""
+        try:
+            os.remove(os.path.join(self.output_dir, filename))
+        except FileNotFoundError:
+            pass
+
+    def _write(self, filename: str, content: str) -> None:
+        """Replace a file in the output directory atomically."""
+        path = os.path.join(self.output_dir, filename)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+# Shared across all sessions of the Streamlit server
+profiler = Profiler(PROFILING, PROFILING_SAMPLE_RATE, PROFILE_DIR)
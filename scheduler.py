@@ -0,0 +1,266 @@
+"""
+Client-side rate limiting and fair scheduling of chat requests.
+"""
+import math
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List
+
+from config import RATE_LIMITING, MAX_CONCURRENT_REQUESTS, QUEUE_TIMEOUT, WAIT_STATS_INTERVAL
+from logger import api_logger
+
+class SchedulerError(Exception):
+    """Raised when a request is rate limited or times out in the queue."""
+    pass
+
+@dataclass(frozen=True)
+class RateLimit:
+    requests_per_minute: float
+    burst: int
+
+    def __post_init__(self):
+        if self.requests_per_minute <= 0:
+            raise ValueError("requests_per_minute must be greater than 0")
+        if self.burst < 1:
+            raise ValueError("burst must be at least 1")
+
+class TokenBucket:
+    """Token bucket refilled continuously at a fixed rate."""
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """Add the tokens accrued since the last refill, up to the burst size."""
+        rate = self.limit.requests_per_minute / 60
+        self.tokens = min(self.limit.burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+    def retry_after(self) -> float:
+        """Seconds until a full token is available (assumes a fresh refill)."""
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) * 60 / self.limit.requests_per_minute
+
+    def refund(self, now: float) -> None:
+        """Give back a token taken by a request that was never dispatched."""
+        self.refill(now)
+        self.tokens = min(self.limit.burst, self.tokens + 1)
+
+@dataclass(order=True)
+class _Ticket:
+    start_tag: float
+    seq: int
+    role: str = field(compare=False)
+    enqueued_at: float = field(compare=False)
+    # Role's finish tag before this ticket, restored if it times out
+    previous_finish: float = field(compare=False)
+    granted: bool = field(default=False, compare=False)
+
+class RequestScheduler:
+    """
+    Admits requests through per-role and per-department token buckets and
+    dispatches them in weighted fair order once the concurrency budget is
+    exhausted.
+
+    Queued requests are ordered by start-time fair queueing: each role's
+    requests get a virtual start tag that advances by 1/weight per request,
+    so a role with weight 2 is dispatched twice as often as a role with
+    weight 1 while both are waiting.
+    """
+
+    def __init__(self, max_concurrency: int, queue_timeout: float, stats_interval: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.stats_interval = stats_interval
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue: list[_Ticket] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._last_finish: Dict[str, float] = {}
+
+        self._role_weights: Dict[str, float] = {}
+        self._role_buckets: Dict[str, TokenBucket] = {}
+        self._department_buckets: Dict[str, TokenBucket] = {}
+        self._wait_stats: Dict[str, Dict[str, float]] = {}
+        self._stats_logged_at = time.monotonic()
+
+    def configure(
+        self,
+        role_limits: Dict[str, RateLimit],
+        department_limits: Dict[str, RateLimit],
+        role_weights: Dict[str, float],
+    ) -> None:
+        """
+        Apply rate limits and weights. Safe to call on every rerun: buckets
+        whose limit is unchanged keep their current token count.
+
+        Args:
+            role_limits: Token bucket settings keyed by role
+            department_limits: Token bucket settings keyed by department
+            role_weights: Fair queueing weight keyed by role (default: 1.0)
+        """
+        with self._cond:
+            self._role_weights = dict(role_weights)
+            self._update_buckets(self._role_buckets, role_limits)
+            self._update_buckets(self._department_buckets, department_limits)
+
+    @staticmethod
+    def _update_buckets(buckets: Dict[str, TokenBucket], limits: Dict[str, RateLimit]) -> None:
+        for name in list(buckets):
+            if name not in limits:
+                del buckets[name]
+        for name, limit in limits.items():
+            bucket = buckets.get(name)
+            if bucket is None:
+                buckets[name] = TokenBucket(limit)
+            elif bucket.limit != limit:
+                bucket.refill(time.monotonic())
+                bucket.limit = limit
+                bucket.tokens = min(bucket.tokens, limit.burst)
+
+    def _admit(self, role: str, department: str, now: float) -> List[TokenBucket]:
+        """Take one token from the role and department buckets or raise."""
+        buckets = [
+            (f"role '{role}'", self._role_buckets.get(role)),
+            (f"department '{department}'", self._department_buckets.get(department)),
+        ]
+        buckets = [(label, bucket) for label, bucket in buckets if bucket is not None]
+
+        for _, bucket in buckets:
+            bucket.refill(now)
+        for label, bucket in buckets:
+            if bucket.tokens < 1:
+                retry_after = bucket.retry_after()
+                seconds = math.ceil(retry_after)
+                api_logger.warning(f"Rate limit exceeded for {label}, retry in {retry_after:.1f}s")
+                raise SchedulerError(
+                    f"Too many requests for {label}. "
+                    f"Please retry in {seconds} second{'' if seconds == 1 else 's'}."
+                )
+        for _, bucket in buckets:
+            bucket.tokens -= 1
+        return [bucket for _, bucket in buckets]
+
+    def _dispatch(self) -> None:
+        """Grant slots to the queued requests with the lowest start tags."""
+        dispatched = False
+        while self._queue and self._active < self.max_concurrency:
+            ticket = heapq.heappop(self._queue)
+            ticket.granted = True
+            self._virtual_time = ticket.start_tag
+            self._active += 1
+            dispatched = True
+        if dispatched:
+            self._cond.notify_all()
+
+    def _record_wait(self, role: str, wait: float) -> None:
+        stats = self._wait_stats.setdefault(role, {"requests": 0, "total_wait": 0.0, "max_wait": 0.0})
+        stats["requests"] += 1
+        stats["total_wait"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+
+        now = time.monotonic()
+        if self.stats_interval > 0 and now - self._stats_logged_at >= self.stats_interval:
+            self._stats_logged_at = now
+            summary = ", ".join(
+                f"{name}: n={s['requests']} avg={s['total_wait'] / s['requests']:.3f}s max={s['max_wait']:.3f}s"
+                for name, s in sorted(self._wait_stats.items())
+            )
+            api_logger.info(f"Queue wait per role: {summary}")
+
+    def acquire(self, role: str, department: str) -> None:
+        """
+        Admit a request and block until it is dispatched.
+
+        Args:
+            role: The role of the user making the request
+            department: The department the request is charged to
+
+        Raises:
+            SchedulerError: If a rate limit is exceeded or the queue wait times out
+        """
+        with self._cond:
+            enqueued_at = time.monotonic()
+            buckets = self._admit(role, department, enqueued_at)
+
+            weight = self._role_weights.get(role, 1.0)
+            previous_finish = self._last_finish.get(role, 0.0)
+            start_tag = max(self._virtual_time, previous_finish)
+            self._last_finish[role] = start_tag + 1 / weight
+            ticket = _Ticket(start_tag, next(self._seq), role, enqueued_at, previous_finish)
+            heapq.heappush(self._queue, ticket)
+            self._dispatch()
+
+            deadline = enqueued_at + self.queue_timeout
+            while not ticket.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(ticket)
+                    heapq.heapify(self._queue)
+                    # A request that was never sent costs no budget or fair share
+                    now = time.monotonic()
+                    for bucket in buckets:
+                        bucket.refund(now)
+                    if not any(queued.role == role for queued in self._queue):
+                        self._last_finish[role] = ticket.previous_finish
+                    self._record_wait(role, now - enqueued_at)
+                    api_logger.warning(f"Request for role '{role}' timed out in queue")
+                    raise SchedulerError("The assistant is busy. Please try again shortly.")
+                self._cond.wait(remaining)
+
+            wait = time.monotonic() - enqueued_at
+            self._record_wait(role, wait)
+            api_logger.debug(f"Dispatched request for role '{role}' after {wait:.3f}s in queue")
+
+    def release(self) -> None:
+        """Return a concurrency slot and dispatch the next queued request."""
+        with self._cond:
+            self._active -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, role: str, department: str) -> Iterator[None]:
+        """
+        Hold a concurrency slot for the duration of a request.
+
+        Args:
+            role: The role of the user making the request
+            department: The department the request is charged to
+
+        Raises:
+            SchedulerError: If a rate limit is exceeded or the queue wait times out
+        """
+        if not RATE_LIMITING:
+            yield
+            return
+
+        self.acquire(role, department)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def wait_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Get queue wait statistics per role.
+
+        Returns:
+            Mapping of role to request count, average, total and maximum wait in seconds
+        """
+        with self._cond:
+            return {
+                role: {**stats, "avg_wait": stats["total_wait"] / stats["requests"]}
+                for role, stats in self._wait_stats.items()
+            }
+
+# Shared across all sessions of the Streamlit server
+request_scheduler = RequestScheduler(MAX_CONCURRENT_REQUESTS, QUEUE_TIMEOUT, WAIT_STATS_INTERVAL)
@@ -8,6 +8,7 @@ from datetime import datetime
 
 from config import get_chat_endpoint, get_health_endpoint
 from logger import api_logger
+from scheduler import request_scheduler, SchedulerError
 
 class APIError(Exception):
     """Custom exception for API-related errors."""
@@ -17,52 +18,65 @@ class ChatService:
     """Service for handling chat-related API interactions."""
 
     @staticmethod
-    def send_message(question: str, user_role: str = "admin") -> Generator[str, None, None]:
+    def send_message(
+        question: str,
+        user_role: str = "admin",
+        department: str = "general"
+    ) -> Generator[str, None, None]:
         """
         Send a message to the chat API and yield streaming responses.
 
+        The request is subject to the role and department rate limits and
+        waits in the fair queue while the concurrency budget is exhausted.
+
         Args:
             question: The user's question
             user_role: The role of the user making the request (default: "admin")
+            department: The department the request is charged to (default: "general")
 
         Yields:
             Text chunks from the response
 
         Raises:
-            APIError: If there's an error communicating with the API
+            APIError: If there's an error communicating with the API or the request is rate limited
         """
         endpoint = get_chat_endpoint()
 
         try:
-            start_time = datetime.now()
-
-            # Make streaming request
-            with requests.post(
-                endpoint,
-                json={"question": question, "user_role": user_role},
-                stream=True,
-                timeout=30
-            ) as response:
-                response.raise_for_status()
-
-                # Process the streaming response
-                buffer = ""
-                for line in response.iter_lines():
-                    if line:
-                        try:
-                            # Decode the line and parse JSON
-                            chunk = json.loads(line.decode('utf-8'))
-                            if 'content' in chunk:
-                                content = chunk['content']
-                                yield content
-
-                        except json.JSONDecodeError as e:
-                            api_logger.warning(f"Failed to parse chunk: {line.decode('utf-8')}")
-                            continue
-
-            # Log completion
-            response_time = (datetime.now() - start_time).total_seconds()
-            api_logger.info(f"Request completed in {response_time:.2f} seconds")
+            # Wait for the scheduler to grant a slot
+            with request_scheduler.slot(user_role, department):
+                start_time = datetime.now()
+
+                # Make streaming request
+                with requests.post(
+                    endpoint,
+                    json={"question": question, "user_role": user_role},
+                    stream=True,
+                    timeout=30
+                ) as response:
+                    response.raise_for_status()
+
+                    # Process the streaming response
+                    buffer = ""
+                    for line in response.iter_lines():
+                        if line:
+                            try:
+                                # Decode the line and parse JSON
+                                chunk = json.loads(line.decode('utf-8'))
+                                if 'content' in chunk:
+                                    content = chunk['content']
+                                    yield content
+
+                            except json.JSONDecodeError as e:
+                                api_logger.warning(f"Failed to parse chunk: {line.decode('utf-8')}")
+                                continue
+
+                # Log completion
+                response_time = (datetime.now() - start_time).total_seconds()
+                api_logger.info(f"Request completed in {response_time:.2f} seconds")
+
+        except SchedulerError as e:
+            raise APIError(str(e))
 
         except requests.exceptions.RequestException as e:
             error_msg = f"Failed to communicate with chat service: {str(e)}"